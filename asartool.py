@@ -5,23 +5,179 @@
 import os
 import errno
 import io
+import mmap
+import re
 import struct
 import shutil
 import json
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from array import array
 from pathlib import Path
 from typing import Union, Dict, Any
 
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
 
 def round_up(i: int, m: int) -> int:
     return (i + m - 1) & ~(m - 1)
 
 
+PREFETCH_WINDOW = 16
+PREFETCH_BYTES = 4 << 20
+LOOKUP_CACHE_SIZE = 256
+
+# data_size, header_size, header_object_size, header_string_size
+PREFIX = struct.Struct('<4I')
+
+_KERNEL_COPIES = []
+if hasattr(os, 'copy_file_range'):
+    _KERNEL_COPIES.append(lambda in_fd, out_fd, offset, count: os.copy_file_range(in_fd, out_fd, count, offset))
+if hasattr(os, 'sendfile'):
+    _KERNEL_COPIES.append(lambda in_fd, out_fd, offset, count: os.sendfile(out_fd, in_fd, offset, count))
+
+
+def copy_range(in_fd: int, out_fd: int, offset: int, size: int) -> bool:
+    """Copy size bytes at offset of in_fd to out_fd in-kernel, return False if no method is supported"""
+    for copy in _KERNEL_COPIES:
+        copied = 0
+        try:
+            while copied < size:
+                n = copy(in_fd, out_fd, offset + copied, size - copied)
+                if not n:
+                    break
+                copied += n
+        except OSError:
+            # Nothing copied yet means this method is unsupported here, try the next one
+            if copied:
+                raise
+            continue
+        # Some filesystems report an unsupported copy_file_range as 0 bytes copied,
+        # a 0 after progress is the real end of the archive
+        if copied or not size:
+            return True
+    return False
+
+
+def compile_exclude(patterns: list):
+    """Build a matcher telling whether a path contains any of the patterns"""
+    if not patterns:
+        return lambda file_path: False
+
+    # A regex alternation backtracks per pattern, the automaton scans each path once
+    if ahocorasick is not None and len(patterns) > 32 and all(patterns):
+        automaton = ahocorasick.Automaton()
+        for pattern in patterns:
+            automaton.add_word(pattern, pattern)
+        automaton.make_automaton()
+        return lambda file_path: next(automaton.iter(file_path), None) is not None
+
+    return re.compile('|'.join(map(re.escape, patterns))).search
+
+
+def parse_header(header_json: bytes) -> Dict[str, Any]:
+    """Parse the raw header bytes, lazily via simdjson when available"""
+    try:
+        if simdjson is not None:
+            # The returned proxy keeps its parser alive, so one parser per header
+            return simdjson.Parser().parse(header_json, recursive=False)
+        if orjson is not None:
+            # Validates UTF-8 while tokenizing, no separate decode pass over the bytes
+            return orjson.loads(header_json)
+    except ValueError:
+        # Headers with escaped lone surrogates (undecodable names) only parse with json
+        pass
+    return json.loads(header_json)
+
+
+def open_source(file_path: str):
+    """Open a source file and ask the kernel to start reading its head ahead"""
+    src = open(file_path, 'rb')
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            # Only the first few MiB, whole large files would be evicted before sendfile gets there
+            os.posix_fadvise(src.fileno(), 0, PREFETCH_BYTES, os.POSIX_FADV_WILLNEED)
+        except OSError:
+            src.close()
+            raise
+    return src
+
+
+def copy_into(fp: io.IOBase, src: io.IOBase):
+    """Append the contents of src to fp, copying in-kernel when fp is a real file"""
+    try:
+        out_fd = fp.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        out_fd = None
+
+    if out_fd is not None and hasattr(os, 'sendfile'):
+        fp.flush()
+        offset = 0
+        try:
+            while True:
+                sent = os.sendfile(out_fd, src.fileno(), offset, 1 << 30)
+                if not sent:
+                    break
+                offset += sent
+        except OSError:
+            # Nothing sent yet means sendfile is unsupported here, fall back below
+            if offset:
+                raise
+        else:
+            # Resync the buffered position with the fd offset advanced by sendfile,
+            # a non-seekable writer has no position to fix after the flush
+            if fp.seekable():
+                fp.seek(os.lseek(out_fd, 0, os.SEEK_CUR))
+            return
+
+    shutil.copyfileobj(src, fp)
+
+
+def dump_header(header: Dict[str, Any]) -> bytes:
+    """Serialize a header to compact JSON bytes with sorted keys"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(header, option=orjson.OPT_SORT_KEYS)
+        except orjson.JSONEncodeError:
+            # Undecodable names come back from scandir surrogate-escaped, only json can write those
+            pass
+    return json.dumps(header, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
 class Asar:
     def __init__(self, path: str, fp: io.IOBase, header: Dict[str, Any], base_offset: int):
         self.path = path
         self.fp = fp
         self.header = header
         self.base_offset = base_offset
+        try:
+            self.fd = fp.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            self.fd = None
+        self.mm = None
+        self.mv = None
+        if self.fd is not None:
+            try:
+                self.mm = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+                self.mv = memoryview(self.mm)
+            except (OSError, ValueError):
+                pass
+        self._index = None
+        self._lookups = OrderedDict()
 
     @classmethod
     def open(cls, path: Union[str, Path]):
@@ -29,51 +185,64 @@ class Asar:
         path = str(path)
         try:
             fp = open(path, 'rb')
-            data_size, header_size, header_object_size, header_string_size = struct.unpack('<4I', fp.read(16))
-            header_json = fp.read(header_string_size).decode('utf-8')
+            data_size, header_size, header_object_size, header_string_size = PREFIX.unpack(fp.read(PREFIX.size))
+            header_json = fp.read(header_string_size)
             return cls(
                 path=path,
                 fp=fp,
-                header=json.loads(header_json),
+                header=parse_header(header_json),
                 base_offset=round_up(16 + header_string_size, 4)
             )
         except Exception as e:
             raise Exception(f"Failed to open ASAR file: {e}")
 
     @classmethod
-    def compress(cls, path: Union[str, Path], exclude_patterns: list = None):
-        """Compress a directory into ASAR format"""
+    def compress(cls, path: Union[str, Path], exclude_patterns: list = None, fp: io.IOBase = None):
+        """Compress a directory into ASAR format, written to fp or kept in memory"""
         path = str(path)
-        exclude_patterns = exclude_patterns or []
+        header, paths = cls._build_header(path, exclude_patterns)
+
+        if fp is None:
+            fp = io.BytesIO()
+        header_string_size = cls._write_archive(fp, header, paths)
+
+        return cls(
+            path=path,
+            fp=fp,
+            header=header,
+            base_offset=round_up(16 + header_string_size, 4))
+
+    @staticmethod
+    def _build_header(path: str, exclude_patterns: list = None):
+        """Scan a directory and return its header along with the file paths in payload order"""
         offset = 0
         paths = []
 
-        def should_exclude(file_path: str) -> bool:
-            """Check if file should be excluded based on patterns"""
-            for pattern in exclude_patterns:
-                if pattern in file_path:
-                    return True
-            return False
+        should_exclude = compile_exclude(exclude_patterns)
 
-        def _path_to_dict(dir_path: str) -> Dict[str, Any]:
-            nonlocal offset, paths
-            result = {'files': {}}
+        header = {'files': {}}
+        pending = [(path, header['files'])]
 
+        # Directories are queued instead of recursed into, excluded ones are never scanned
+        while pending:
+            dir_path, files = pending.pop()
             try:
                 for f in os.scandir(dir_path):
                     if should_exclude(f.path):
                         continue
 
-                    if os.path.isdir(f.path):
-                        result['files'][f.name] = _path_to_dict(f.path)
-                    elif f.is_symlink():
-                        result['files'][f.name] = {
+                    if f.is_symlink():
+                        files[f.name] = {
                             'link': os.path.realpath(f.name)
                         }
+                    elif f.is_dir(follow_symlinks=False):
+                        files[f.name] = {'files': {}}
+                        pending.append((f.path, files[f.name]['files']))
                     else:
                         paths.append(f.path)
-                        size = f.stat().st_size
-                        result['files'][f.name] = {
+                        size = f.stat(follow_symlinks=False).st_size
+                        # The asar format wants string offsets, cheaper here than patching the serialized header
+                        files[f.name] = {
                             'size': size,
                             'offset': str(offset)
                         }
@@ -81,21 +250,12 @@ class Asar:
             except PermissionError as e:
                 print(f"Skipping directory due to permission error: {dir_path}")
 
-            return result
-
-        def _paths_to_bytes(file_paths: list) -> bytes:
-            """Convert files to bytes"""
-            _bytes = io.BytesIO()
-            for file_path in file_paths:
-                try:
-                    with open(file_path, 'rb') as f:
-                        _bytes.write(f.read())
-                except Exception as e:
-                    print(f"Failed to read file: {file_path}, error: {e}")
-            return _bytes.getvalue()
+        return header, paths
 
-        header = _path_to_dict(path)
-        header_json = json.dumps(header, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    @staticmethod
+    def _write_archive(fp: io.IOBase, header: Dict[str, Any], paths: list) -> int:
+        """Write the prefix, header and file contents to fp, return the header string size"""
+        header_json = dump_header(header)
         header_string_size = len(header_json)
         data_size = 4
         aligned_size = round_up(header_string_size, data_size)
@@ -104,58 +264,116 @@ class Asar:
         diff = aligned_size - header_string_size
         header_json = header_json + b'\0' * diff if diff else header_json
 
-        fp = io.BytesIO()
-        fp.write(struct.pack('<4I', data_size, header_size, header_object_size, header_string_size))
+        fp.write(PREFIX.pack(data_size, header_size, header_object_size, header_string_size))
         fp.write(header_json)
-        fp.write(_paths_to_bytes(paths))
 
-        return cls(
-            path=path,
-            fp=fp,
-            header=header,
-            base_offset=round_up(16 + header_string_size, 4))
-
-    def list_files(self, prefix: str = "") -> list:
-        """Return list of files in the ASAR archive"""
-        files = []
-
-        def _walk_files(files_dict: Dict[str, Any], current_path: str = ""):
-            for name, info in files_dict.items():
-                full_path = os.path.join(current_path, name).replace('\\', '/')
+        # Keep a window of files opening and reading ahead while they are written in order
+        pending = iter(paths)
+        window = deque()
+        with ThreadPoolExecutor(max_workers=PREFETCH_WINDOW) as executor:
+            for file_path in islice(pending, PREFETCH_WINDOW):
+                window.append((file_path, executor.submit(open_source, file_path)))
+
+            while window:
+                file_path, future = window.popleft()
+                for next_path in islice(pending, 1):
+                    window.append((next_path, executor.submit(open_source, next_path)))
+                try:
+                    src = future.result()
+                except Exception as e:
+                    print(f"Failed to read file: {file_path}, error: {e}")
+                    continue
+                # Errors writing to fp propagate, a truncated archive must not look successful
+                with src:
+                    copy_into(fp, src)
+
+        return header_string_size
+
+    def _build_index(self):
+        """Flatten the header into path lookups, walking it once"""
+        self._paths = []
+        packed = []
+        self._dirs = set()
+        self._links = {}
+        self._unpacked = []
+        stack = [(iter(self.header['files'].items()), "")]
+
+        while stack:
+            entries, current_path = stack[-1]
+            for name, info in entries:
+                full_path = current_path + name
                 if 'files' in info:
-                    files.append(full_path + '/')  # Directory marker
-                    _walk_files(info['files'], full_path)
+                    self._paths.append(full_path + '/')  # Directory marker
+                    self._dirs.add(full_path)
+                    # Descend before the remaining siblings to keep depth-first order
+                    stack.append((iter(info['files'].items()), full_path + '/'))
+                    break
+                self._paths.append(full_path)
+                if 'link' in info:
+                    self._links[full_path] = info['link']
+                elif 'offset' in info:
+                    packed.append((int(info['offset']), int(info['size']), full_path))
                 else:
-                    files.append(full_path)
-
-        _walk_files(self.header['files'])
-        return [f for f in files if f.startswith(prefix)]
+                    self._unpacked.append(full_path)
+            else:
+                stack.pop()
 
-    def extract_file(self, file_path: str) -> bytes:
-        """Extract a specific file and return as bytes"""
-        def _find_file(files_dict: Dict[str, Any], path_parts: list):
-            if not path_parts:
-                return None
+        # Packed files as parallel arrays in payload order, _index maps a path to its slot
+        packed.sort()
+        self._offsets = array('q', [offset for offset, _, _ in packed])
+        self._sizes = array('q', [size for _, size, _ in packed])
+        self._files = [file_path for _, _, file_path in packed]
+        self._index = {file_path: i for i, file_path in enumerate(self._files)}
 
-            name = path_parts[0]
-            if name not in files_dict:
-                return None
-
-            if len(path_parts) == 1:
-                return files_dict[name]
-            else:
-                if 'files' in files_dict[name]:
-                    return _find_file(files_dict[name]['files'], path_parts[1:])
+    def list_files(self, prefix: str = "") -> list:
+        """Return list of files in the ASAR archive"""
+        if self._index is None:
+            self._build_index()
+        return [f for f in self._paths if f.startswith(prefix)]
+
+    def _find_file(self, file_path: str):
+        """Descend the header along file_path, touching only the nodes on the way"""
+        node = self.header
+        for name in file_path.replace('\\', '/').split('/'):
+            if 'files' not in node or name not in node['files']:
                 return None
+            node = node['files'][name]
+        if 'offset' not in node:
+            return None
+        return int(node['offset']), int(node['size'])
 
-        path_parts = file_path.replace('\\', '/').split('/')
-        file_info = _find_file(self.header['files'], path_parts)
-
-        if not file_info or 'offset' not in file_info:
+    def extract_file(self, file_path: str) -> bytes:
+        """Extract a specific file and return as bytes"""
+        # Once the index exists it answers directly, otherwise only the path is walked
+        if self._index is not None:
+            i = self._index.get(file_path.replace('\\', '/'))
+            entry = None if i is None else (self._offsets[i], self._sizes[i])
+        elif file_path in self._lookups:
+            self._lookups.move_to_end(file_path)
+            entry = self._lookups[file_path]
+        else:
+            # Bounded LRU of hits only, misses are not worth remembering
+            entry = self._find_file(file_path)
+            if entry is not None:
+                self._lookups[file_path] = entry
+                if len(self._lookups) > LOOKUP_CACHE_SIZE:
+                    self._lookups.popitem(last=False)
+
+        if entry is None:
             raise FileNotFoundError(f"File not found: {file_path}")
 
-        self.fp.seek(self.base_offset + int(file_info['offset']))
-        return self.fp.read(int(file_info['size']))
+        offset, size = entry
+        return bytes(self._read(offset, size))
+
+    def _read(self, offset: int, size: int):
+        """Return size bytes at offset relative to the start of the file data, zero-copy when mapped"""
+        if self.mv is not None:
+            start = self.base_offset + offset
+            return self.mv[start:start + size]
+        if self.fd is None or not hasattr(os, 'pread'):
+            self.fp.seek(self.base_offset + offset)
+            return self.fp.read(size)
+        return os.pread(self.fd, size, self.base_offset + offset)
 
     def get_file_info(self) -> Dict[str, Any]:
         """Return comprehensive information about the ASAR file"""
@@ -163,7 +381,7 @@ class Asar:
             'path': self.path,
             'base_offset': self.base_offset,
             'file_count': len(self.list_files()),
-            'header': self.header
+            'header': self.header.as_dict() if hasattr(self.header, 'as_dict') else self.header
         }
 
     def _copy_unpacked_file(self, source: str, destination: str):
@@ -181,18 +399,16 @@ class Asar:
         os.makedirs(os.path.dirname(dest), exist_ok=True)
         shutil.copyfile(src, dest)
 
-    def _extract_file(self, source: str, info: Dict[str, Any], destination: str):
-        if 'offset' not in info:
-            self._copy_unpacked_file(source, destination)
-            return
-
-        self.fp.seek(self.base_offset + int(info['offset']))
-        r = self.fp.read(int(info['size']))
-
-        dest = os.path.join(destination, source)
-        os.makedirs(os.path.dirname(dest), exist_ok=True)
-        with open(dest, 'wb') as f:
-            f.write(r)
+    def _extract_file(self, source: str, offset: int, size: int, destination: str):
+        dest = destination + os.sep + source
+        fd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o644)
+        try:
+            if self.fd is None or not copy_range(self.fd, fd, self.base_offset + offset, size):
+                r = memoryview(self._read(offset, size))
+                while r:
+                    r = r[os.write(fd, r):]
+        finally:
+            os.close(fd)
 
     def _extract_link(self, source: str, link: str, destination: str):
         dest_filename = os.path.normpath(os.path.join(destination, source))
@@ -208,42 +424,48 @@ class Asar:
             else:
                 raise e
 
-    def _extract_directory(self, source: str, files: Dict[str, Any], destination: str):
-        dest = os.path.normpath(os.path.join(destination, source))
-
-        if not os.path.exists(dest):
-            os.makedirs(dest)
-
-        for name, info in files.items():
-            item_path = os.path.join(source, name)
-
-            if 'files' in info:
-                self._extract_directory(item_path, info['files'], destination)
-            elif 'link' in info:
-                self._extract_link(item_path, info['link'], destination)
-            else:
-                self._extract_file(item_path, info, destination)
+    def _collect_dirs(self, base: str) -> list:
+        """Return every directory in the archive under base, parents before children"""
+        if self._index is None:
+            self._build_index()
+        return [base + os.sep + d for d in sorted(self._dirs, key=lambda d: d.count('/'))]
 
     def extract(self, path: Union[str, Path]):
         """Extract the entire ASAR archive"""
         path = str(path)
         if os.path.exists(path):
             raise FileExistsError(f"Target path already exists: {path}")
-        self._extract_directory('.', self.header['files'], path)
+
+        os.makedirs(path)
+        for d in self._collect_dirs(path):
+            os.makedirs(d, exist_ok=True)
+
+        # Payload order turns scattered reads into one front-to-back pass over the archive
+        for source, offset, size in zip(self._files, self._offsets, self._sizes):
+            self._extract_file(source, offset, size, path)
+        for source in self._unpacked:
+            self._copy_unpacked_file(source, path)
+        for source, link in self._links.items():
+            self._extract_link(source, link, path)
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
+        if self.mm is not None:
+            self.mv.release()
+            try:
+                self.mm.close()
+            except BufferError:
+                # A slice from _read is still alive, the map is unmapped once it is collected
+                pass
         self.fp.close()
 
 
 def pack_asar(source: Union[str, Path], dest: Union[str, Path], exclude_patterns: list = None):
     """Compress a directory into an ASAR file"""
-    with Asar.compress(source, exclude_patterns) as a:
-        with open(str(dest), 'wb') as fp:
-            a.fp.seek(0)
-            fp.write(a.fp.read())
+    with open(str(dest), 'wb', buffering=1 << 20) as fp:
+        Asar.compress(source, exclude_patterns, fp)
     print(f"ASAR file created successfully: {dest}")
 
 